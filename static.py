@@ -5,22 +5,51 @@ import glob
 import hashlib
 import json
 import os
-import sys
+import queue
+import re
+import sqlite3
+import stat
 import string
+import sys
+import threading
+import time
 import yaml
-
-from shutil import copy
-from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import zlib
+
+from collections import defaultdict
+from contextlib import closing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from shutil import copyfile
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, \
+    Template, select_autoescape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from markdown_it import MarkdownIt
 from markdown_it.token import Token
 from mdit_py_plugins.front_matter import front_matter_plugin
 from mdit_py_plugins.dollarmath import dollarmath_plugin
-from typing import Callable, Dict, List, Optional, Set, Tuple
-from watchdog.events import FileSystemEventHandler, DirModifiedEvent, \
-    FileModifiedEvent
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, Set, Tuple, Union
+from watchdog.events import FileSystemEvent, FileSystemEventHandler, \
+    DirModifiedEvent, FileModifiedEvent
 from watchdog.observers import Observer
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# LibYAML's parser when PyYAML was built with it, the pure Python one if not.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 """
 n commands:
     static create
@@ -45,7 +74,76 @@ FOLDERS = {
     "data": os.path.join(BASE_DIR, "data"),
 }
 
-FileInfo = Dict[str, str]
+# Folders whose files are tracked in the history, mapped to the extension
+# of the files they hold ("" for any file).
+ROUTES = {
+    "templates": ".html",
+    "posts": ".md",
+    "assets": "",
+    "data": ".json",
+}
+
+# Below this many changed posts, starting worker processes costs more than
+# rendering the posts in this one.
+PARALLEL_POSTS_THRESHOLD = 8
+# Seconds the dev server waits for a file to stop changing before telling the
+# browser to reload.
+MODIFIED_DEBOUNCE = 0.05
+# Seconds between keep-alive comments on an idle event stream, which is also
+# how long it takes to notice that a browser tab has gone away.
+EVENTS_KEEPALIVE = 15
+
+# A whitespace-delimited token which is only letters once leading and trailing
+# ASCII punctuation is stripped, the same as str.strip(string.punctuation)
+# followed by str.isalpha().
+WORD_RE = re.compile(r"(?<!\S)[{0}]*[^\W\d_]+[{0}]*(?!\S)".format(
+    re.escape(string.punctuation)))
+
+PATH_SEP_RE = re.compile(r"[\\/]")
+
+# Directory mtimes this close to the time of a scan are not trusted, since a
+# coarse timestamp may not move again for an entry added within the same tick.
+DIR_MTIME_SLACK_NS = 2 * 10**9
+STAT_DIR_FD = os.stat in os.supports_dir_fd
+
+# A "key: value" line of flat front matter, and what rules a value out of
+# being taken as a plain string without asking the YAML parser.
+FLAT_YAML_LINE_RE = re.compile(r"([A-Za-z_][\w-]*): +(\S.*?) *")
+FLAT_YAML_UNSAFE_RE = re.compile(r"\t|: |:$| #")
+YAML_INDICATORS = "-?:,[]{}#&*!|>'\"%@`"
+
+# How much of a post to read looking for the end of its front matter before
+# falling back to parsing the whole post.
+FRONT_MATTER_PEEK = 8192
+# Any line markdown-it could take as the end of front matter.
+FRONT_MATTER_FENCE_RE = re.compile(r" {0,3}-{3,}[ \t]*")
+
+# The algorithm's name is stored in the history so that switching between
+# the two forces a rehash instead of comparing incompatible digests.
+HASH_ALGO = "blake3" if blake3 else "blake2b-128"
+HASH_CHUNK_SIZE = 1 << 20
+FADVISE = hasattr(os, "posix_fadvise")
+# Files are hashed from several threads, each with a buffer of its own.
+_hash_local = threading.local()
+
+HISTORY_PATH = os.path.join(BASE_DIR, "history.db")
+# Where the history was kept before history.db. Read once to migrate it.
+LEGACY_HISTORY_PATH = os.path.join(BASE_DIR, "history.json")
+HISTORY_VERSION = 2
+# Keys of the history, other than the folders' records, kept in its state table.
+HISTORY_STATE = ("version", "algo", "dirs", "stamps", "dep_tree")
+# Never matches a real file, so anything carrying it is rebuilt once.
+STALE_RECORD = [-1, -1, -1, b""]
+META_PATH = os.path.join(BASE_DIR, "meta.json")
+# Compiled templates, kept between runs so that templates which did not
+# change are not parsed again.
+TEMPLATE_CACHE_DIR = os.path.join(BASE_DIR, ".jinja_cache")
+
+# [mod_date (ns), size, inode, hash] of a tracked file, as in the columns of
+# its row in history.db. An empty hash has not been computed yet: a file seen
+# for the first time is built whatever its contents, so it is only hashed
+# once the build's outputs have been written.
+FileInfo = List[Union[int, bytes]]
 FolderInfo = Dict[str, FileInfo]
 FolderChanges = Tuple[FolderInfo, Set[str]]
 
@@ -57,11 +155,15 @@ md = (
 
 env = Environment(
     loader=FileSystemLoader(searchpath=[FOLDERS["templates"]]),
-    autoescape=select_autoescape()
+    autoescape=select_autoescape(),
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
 )
+_template_cache: Dict[str, Template] = {}
+# The records as they are in history.db, so that only changed ones are written.
+_saved_records: Dict[Tuple[str, str], Tuple] = {}
 
 
-def get_args() -> str:
+def get_args() -> argparse.Namespace:
     """
     Parses through and validates command line arguments.
     """
@@ -69,8 +171,10 @@ def get_args() -> str:
     parser = argparse.ArgumentParser()
     parser.add_argument('command',
                         choices=['create', 'generate', 'run', 'diff'])
-    arg = parser.parse_args()
-    return arg.command
+    parser.add_argument('--verify', action='store_true',
+                        help="hash files whose size and modification time "
+                             "are unchanged to catch edits that kept both")
+    return parser.parse_args()
 
 
 def create() -> None:
@@ -82,7 +186,7 @@ def create() -> None:
         -> templates/
         -> posts/
         -> site/
-        -> history.json
+        -> history.db
         -> meta.json
     """
 
@@ -109,18 +213,290 @@ def create() -> None:
                 "assets": [],
     }
     meta = {"base": base_templates, "no_output": no_output}
-    history = {"assets": {}, "data": {}, "templates": {}, "posts": {}}
-    with open('meta.json', 'w') as f:
-        json.dump(meta, f, indent=4)
-    with open("history.json", 'w') as f:
-        json.dump(history, f, indent=4)
+    history = {"version": HISTORY_VERSION, "algo": HASH_ALGO,
+               **{folder: {} for folder in ROUTES}}
+    dump_json(meta, META_PATH, pretty=True)
+    save_history(history)
     print("Done!")
 
 
-def recursively_act_on_dir(pattern: str) -> Callable:
+def walk(root: str, ext: Optional[str] = "") -> Iterator[os.DirEntry]:
+    """
+    Yields every file under root whose name ends with ext. Hidden entries are
+    skipped and symlinked directories followed, as they were by the recursive
+    glob this replaces. A directory reached twice through symlinks is only
+    listed once, so a link back to a parent does not loop forever.
+    """
+
+    stack = [root]
+    visited = set()
+    while stack:
+        path = stack.pop()
+        try:
+            st = os.stat(path)
+            it = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with it:
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif not ext or entry.name.endswith(ext):
+                    yield entry
+
+
+class KnownFile(NamedTuple):
+    """
+    Stands in for the os.DirEntry of a file whose directory was not listed
+    again because it had not changed.
+    """
+
+    path: str
+    name: str
+    st: os.stat_result
+
+    def stat(self) -> os.stat_result:
+        return self.st
+
+
+def scan_folder(folder: str, ext: str, past_dirs: Dict[str, Optional[int]],
+                past_files: Iterable[str]) \
+        -> Tuple[List[Union[os.DirEntry, KnownFile]], Dict[str, Optional[int]]]:
+    """
+    Lists the files under folder like walk() does, but without reading
+    directories whose mtime matches past_dirs. Adding, removing or renaming
+    an entry bumps a directory's mtime, so the files of an unchanged
+    directory are the ones already known from past_files (names relative to
+    folder) and only need a stat.
+
+    Returns the files along with the mtime of every directory seen, to be
+    passed back as past_dirs next time.
+    """
+
+    sep = os.sep
+    prefix = folder + sep
+    files_in = defaultdict(list)
+    for name in past_files:
+        files_in[name.rpartition(sep)[0]].append(name)
+    subdirs_in = defaultdict(list)
+    for rel_dir in past_dirs:
+        if rel_dir:
+            subdirs_in[rel_dir.rpartition(sep)[0]].append(rel_dir)
+
+    trusted_before = time.time_ns() - DIR_MTIME_SLACK_NS
+    files = []
+    dirs = {}
+    # Symlinked directories are followed, and each directory is only listed
+    # once in case links lead back to one already seen.
+    visited = set()
+    try:
+        stack = [("", os.stat(folder))]
+    except FileNotFoundError:
+        return (files, dirs)
+    while stack:
+        (rel_dir, dir_st) = stack.pop()
+        if (dir_st.st_dev, dir_st.st_ino) in visited:
+            continue
+        visited.add((dir_st.st_dev, dir_st.st_ino))
+        mtime = dir_st.st_mtime_ns
+        dirs[rel_dir] = mtime if mtime < trusted_before else None
+
+        if past_dirs.get(rel_dir) == mtime:
+            # Stat the entries relative to their directory where the platform
+            # allows it, so the kernel resolves only the last component.
+            dir_fd = None
+            if STAT_DIR_FD:
+                try:
+                    dir_fd = os.open(prefix + rel_dir, os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+            try:
+                for name in files_in[rel_dir]:
+                    path = prefix + name
+                    base = name.rpartition(sep)[2]
+                    try:
+                        st = os.stat(path if dir_fd is None else base,
+                                     dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        continue
+                    files.append(KnownFile(path, base, st))
+                for subdir in subdirs_in[rel_dir]:
+                    try:
+                        subdir_st = os.stat(prefix + subdir if dir_fd is None
+                                            else subdir.rpartition(sep)[2],
+                                            dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        continue
+                    stack.append((subdir, subdir_st))
+            finally:
+                if dir_fd is not None:
+                    os.close(dir_fd)
+            continue
+
+        dir_prefix = rel_dir + sep if rel_dir else ""
+        with os.scandir(prefix + rel_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    stack.append((dir_prefix + entry.name, entry.stat()))
+                elif not ext or entry.name.endswith(ext):
+                    files.append(entry)
+    return (files, dirs)
+
+
+def scan_routes(history: Dict) -> Dict[str, List[os.DirEntry]]:
+    """
+    Lists the files of every folder in ROUTES in a single traversal, grouped
+    by the folder they belong to. The directory mtimes seen are stored in
+    history so the next scan can skip unchanged directories.
+    """
+
+    past_dirs = history.get("dirs", {})
+    listing = {}
+    dirs = {}
+    for (folder, ext) in ROUTES.items():
+        listing[folder], dirs[folder] = scan_folder(
+            folder, ext, past_dirs.get(folder, {}), history[folder])
+    history["dirs"] = dirs
+    return listing
+
+
+def load_json(path: str) -> Dict:
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump_json(obj: Dict, path: str, pretty: bool = False) -> None:
+    """
+    Writes obj to path as JSON, using orjson when it is installed. Files that
+    are meant to be edited by hand should be written with pretty set.
+    """
+
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj,
+                                 option=orjson.OPT_INDENT_2 if pretty else 0))
+        return
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=4 if pretty else None)
+
+
+def open_history() -> sqlite3.Connection:
+    conn = sqlite3.connect(HISTORY_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS files (folder TEXT, name TEXT, "
+                 "mod_date INTEGER, size INTEGER, inode INTEGER, hash BLOB, "
+                 "PRIMARY KEY (folder, name)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS state "
+                 "(key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def load_history() -> Dict:
+    """
+    Loads the history from history.db, or from history.json if the site has
+    not been generated since the history moved. Records written in an older
+    layout cannot be compared with, so their files are kept (so that
+    deletions are still noticed) but marked as changed. Digests made with a
+    different hash algorithm are dropped, so they are never compared with
+    new ones.
+    """
+
+    if not os.path.isfile(HISTORY_PATH):
+        return load_legacy_history()
+
+    with closing(open_history()) as conn:
+        history = {key: json.loads(value) for (key, value)
+                   in conn.execute("SELECT key, value FROM state")}
+        rows = conn.execute("SELECT * FROM files").fetchall()
+
+    stale = history.get("version") != HISTORY_VERSION
+    same_algo = history.get("algo") == HASH_ALGO
+    for folder in ROUTES:
+        history[folder] = {}
+    _saved_records.clear()
+    for (folder, name, *record) in rows:
+        _saved_records[(folder, name)] = tuple(record)
+        if folder not in ROUTES:
+            continue
+        if stale:
+            record = STALE_RECORD
+        elif not same_algo:
+            record[3] = b""
+        history[folder][name] = record
+    history["version"] = HISTORY_VERSION
+    history["algo"] = HASH_ALGO
+    return history
+
+
+def load_legacy_history() -> Dict:
+    """
+    Loads history.json, where the history was kept before history.db. It is
+    removed once the history has been saved to the database.
+    """
+
+    history = load_json(LEGACY_HISTORY_PATH)
+    if history.get("version") != HISTORY_VERSION:
+        for folder in ROUTES:
+            history[folder] = dict.fromkeys(history.get(folder, {}), STALE_RECORD)
+        history["version"] = HISTORY_VERSION
+        return history
+
+    fromhex = bytes.fromhex
+    same_algo = history.get("algo") == HASH_ALGO
+    for folder in ROUTES:
+        for record in history[folder].values():
+            record[3] = fromhex(record[3]) if same_algo else b""
+    history["algo"] = HASH_ALGO
+    return history
+
+
+def save_history(history: Dict) -> None:
+    """
+    Writes the records which differ from the ones last loaded or saved, and
+    the rest of the history's state, to history.db in one transaction.
+    """
+
+    history["algo"] = HASH_ALGO
+    upserts = []
+    for folder in ROUTES:
+        for (name, record) in history[folder].items():
+            if _saved_records.get((folder, name)) != tuple(record):
+                upserts.append((folder, name, *record))
+    deletes = [key for key in _saved_records
+               if key[1] not in history.get(key[0], ())]
+
+    with closing(open_history()) as conn, conn:
+        conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                         upserts)
+        conn.executemany("DELETE FROM files WHERE folder = ? AND name = ?",
+                         deletes)
+        conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                         [(key, json.dumps(history[key]))
+                          for key in HISTORY_STATE if key in history])
+    for row in upserts:
+        _saved_records[row[:2]] = row[2:]
+    for key in deletes:
+        del _saved_records[key]
+
+    if os.path.isfile(LEGACY_HISTORY_PATH):
+        os.remove(LEGACY_HISTORY_PATH)
+
+
+def recursively_act_on_dir(root: str, ext: Optional[str] = "") -> Callable:
     def decorator(action: Callable) -> Callable:
         def inner() -> None:
-            files = glob.iglob(pattern, recursive=True)
+            files = walk(root, ext)
             returns = dict()
             for file in files:
                 ret = action(file)
@@ -131,103 +507,244 @@ def recursively_act_on_dir(pattern: str) -> Callable:
     return decorator
 
 
-def path_toss(path: str) -> str:
-    tossed = ""
-    c = path[0]
-    while c not in ['\\', '/']:
-        path = path[1:]
-        tossed += c
-        c = path[0]
-    return (tossed, path[1:])
+def new_hash() -> "hashlib._Hash":
+    if blake3:
+        return blake3()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path: str, size: int = 0) -> bytes:
+    """
+    Returns the digest of a file's contents, read in fixed-size chunks so
+    memory use does not grow with the size of the file. With BLAKE3, each
+    chunk of a file known (from size) to be large is hashed on several
+    threads. The file is not mapped into memory, where a file truncated
+    while being hashed would kill the process with SIGBUS.
+    """
+
+    threaded = blake3 is not None and size > HASH_CHUNK_SIZE
+    with open(path, 'rb') as f:
+        if FADVISE:
+            # The file is read once from start to end: let the kernel read
+            # ahead aggressively.
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if not threaded and hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, new_hash).digest()
+
+        buffer = getattr(_hash_local, "buffer", None)
+        if buffer is None:
+            buffer = _hash_local.buffer = bytearray(HASH_CHUNK_SIZE)
+        m = blake3(max_threads=blake3.AUTO) if threaded else new_hash()
+        view = memoryview(buffer)
+        while n := f.readinto(buffer):
+            m.update(view[:n])
+    return m.digest()
+
+
+def copy_file(src: str, dest: str) -> None:
+    """
+    Copies the contents of src to dest. Where copy_file_range is available
+    the kernel does the copy, and filesystems that support it (Btrfs, XFS...)
+    share the data instead of duplicating it. Otherwise, or if the call is
+    refused or stops short (across filesystems, on older kernels, on FUSE...),
+    falls back to shutil.copyfile.
+    """
+
+    if hasattr(os, "copy_file_range"):
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while n := os.copy_file_range(fsrc.fileno(), fdest.fileno(),
+                                              1 << 30):
+                    copied += n
+            except OSError:
+                pass
+            # Some filesystems report the end of the file early instead of
+            # failing, which would leave a truncated copy.
+            if copied == size:
+                return
+    copyfile(src, dest)
+
+
+def get_template(name: str) -> Template:
+    """
+    Returns the compiled template called name, loading it only on first use.
+    Templates are never reloaded, so this is only meant for a single build;
+    the dev server asks env directly, which checks for edits on every use.
+    """
+
+    name = name.replace('\\', '/')
+    template = _template_cache.get(name)
+    if template is None:
+        template = _template_cache[name] = env.get_template(name)
+    return template
+
+
+def path_toss(path: str) -> Tuple[str, str]:
+    sep = PATH_SEP_RE.search(path)
+    return (path[:sep.start()], path[sep.end():])
 
 
-def build_dep_tree(meta: Dict):
+def build_dep_tree(meta: Dict, history: Dict,
+                   listing: Dict[str, List[os.DirEntry]]) -> Dict[str, Set[str]]:
+    """
+    Maps every prerequisite in meta["deps"] to the files that depend on it.
+    The map can only change when the dependency patterns or the set of files
+    do, so it is cached in history under a key derived from both.
+    """
+
     def get_files(pattern: str):
-        files = set(glob.iglob(pattern, recursive=True))
+        files = set(map(os.path.normpath, glob.iglob(pattern, recursive=True)))
         return files
-    prereqs = meta["deps"]
+    prereqs = meta.get("deps", {})
+    if not prereqs:
+        return {}
+
+    paths = sorted(entry.path for entries in listing.values() for entry in entries)
+    key = new_hash()
+    key.update(json.dumps(prereqs, sort_keys=True).encode())
+    key.update("\0".join(paths).encode())
+    key = key.hexdigest()
+    cached = history.get("dep_tree")
+    if cached and cached["key"] == key:
+        return {p: set(dependents) for (p, dependents) in cached["tree"].items()}
+
     dependent = dict()
     for (pattern, prereq) in prereqs.items():
         for p in prereq:
-            p = p.replace('/', '\\')
+            p = os.path.normpath(p)
             if p in dependent:
                 dependent[p].update(get_files(pattern))
             else:
                 dependent[p] = get_files(pattern)
+    history["dep_tree"] = {
+        "key": key,
+        "tree": {p: sorted(dependents) for (p, dependents) in dependent.items()},
+    }
     return dependent
 
 
-def get_changes(history: Dict, meta: Dict, force_recompile: bool = False) \
-        -> Dict[str, FolderChanges]:
-    def _get_changes(path: str, file_past: FileInfo) -> bool:
-        if not os.path.isfile(path):
-            return {}
-
-        curr_mod_date = os.path.getmtime(path)
-        if not file_past or file_past["mod_date"] < curr_mod_date:
-            curr_hash = hashlib.md5(open(path, 'rb').read()).hexdigest()
-            if not file_past or file_past["hash"] != curr_hash:
-                return {
-                    "mod_date": curr_mod_date,
-                    "hash": curr_hash
-                }
-
-        return {}
+def get_changes(history: Dict, meta: Dict, force_recompile: bool = False,
+                verify: bool = False) -> Dict[str, FolderChanges]:
+    def _needs_hash(path: str, file_past: Optional[FileInfo],
+                    st: Optional[os.stat_result] = None) -> Optional[List[int]]:
+        if st is None:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        curr_stat = [st.st_mtime_ns, st.st_size, st.st_ino]
+        if file_past and file_past[:3] == curr_stat and not verify:
+            return None
+        return curr_stat
+
+    def _compare(file_past: Optional[FileInfo], curr_stat: List[int],
+                 curr_hash: bytes) -> Optional[FileInfo]:
+        if file_past and file_past[3] == curr_hash:
+            # Only the mtime or inode moved (a checkout, a restored cache...).
+            # Refresh them so the next run skips the hash.
+            file_past[:3] = curr_stat
+            return None
+        if file_past and not file_past[3] and file_past[:3] == curr_stat:
+            # The digest was never computed and nothing suggests a change.
+            file_past[3] = curr_hash
+            return None
+        return curr_stat + [curr_hash]
+
+    def _get_changes(path: str, file_past: Optional[FileInfo]) \
+            -> Optional[FileInfo]:
+        curr_stat = _needs_hash(path, file_past)
+        if curr_stat is None:
+            return None
+        if file_past is None:
+            return curr_stat + [b""]
+        return _compare(file_past, curr_stat, hash_file(path, curr_stat[1]))
+
+    def folder_changes(name: str, entries: List[os.DirEntry]) -> FolderChanges:
+        # A stamp mixing the path and stats of every file. When it matches the
+        # one from the last run, no file can have changed, been added or been
+        # removed, and the per-file comparison below can be skipped.
+        stamp = 0
+        stats = []
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((entry, st))
+            stamp ^= hash((zlib.crc32(entry.path.encode()), st.st_mtime_ns,
+                           st.st_size, st.st_ino))
+        stamp = [len(stats), stamp]
+        past_stamp = stamps.get(name)
+        stamps[name] = stamp
+        if stamp == past_stamp and not (force_recompile or verify or recompile):
+            return ({}, set())
+
+        past = {} if force_recompile else history[name]
+        past_get = past.get
+        seen = set()
+        changes = {}
+        prefix_len = len(name) + 1
 
-    def folder_changes(name: str, ext: Optional[str] = "",
-                       get_deps: Optional[Callable] = None) -> FolderChanges:
-        @recursively_act_on_dir(f"{name}/**/*{ext}")
-        def populate_changes(file: str) -> None:
-            file_name = os.path.relpath(file, name)
-            new_file = file_name not in past_set
-            if not new_file:
-                past_set.remove(file_name)
+        for (entry, st) in stats:
+            file = entry.path
+            file_name = file[prefix_len:]
+            seen.add(file_name)
+            file_past = past_get(file_name)
             if file in prereqs:
                 print(file, prereq_changed)
                 if file in prereq_changed:
                     changes[file_name] = prereq_info[file]
                     print(changes[file_name])
-                return
-            if file not in recompile or new_file:
-                file_past = {} if new_file or file in recompile \
-                   else past[file_name]
-                file_changes = _get_changes(file, file_past)
-                if file_changes:
-                    changes[file_name] = file_changes
+                continue
+            if file in recompile and file_past is not None:
+                changes[file_name] = file_past
+                continue
+            curr_stat = _needs_hash(file, file_past, st)
+            if curr_stat is None:
+                continue
+            if file_past is None:
+                changes[file_name] = curr_stat + [b""]
             else:
-                changes[file_name] = history[name][file_name]
-
-        if force_recompile:
-            past_set = set()
-        else:
-            past = history[name]
-            past_set = set(past.keys())
-        changes = {}
+                pending.append((changes, file_name, file, file_past, curr_stat))
 
-        populate_changes()
-
-        return (changes, past_set)
+        return (changes, past.keys() - seen)
     all_changes = {}
 
-    dep_tree = build_dep_tree(meta)
+    listing = scan_routes(history)
+    stamps = history.setdefault("stamps", {})
+    dep_tree = build_dep_tree(meta, history, listing)
     recompile = set()
     prereq_info = dict()
     prereq_changed = set()
     prereqs = dep_tree.keys()
     for (prereq, dependents) in dep_tree.items():
         folder, relpath = path_toss(prereq)
-        prereq_history = {} if prereq in recompile \
-            else history[folder][relpath]
+        prereq_history = None if prereq in recompile \
+            else history[folder].get(relpath)
         prereq_changes = _get_changes(prereq, prereq_history)
         if prereq_changes:
             prereq_changed.add(prereq)
             prereq_info[prereq] = prereq_changes
             recompile.update(dependents)
 
-    all_changes["templates"] = folder_changes("templates", ".html")
-    all_changes["posts"] = folder_changes("posts", ".md")
-    all_changes["assets"] = folder_changes("assets")
-    all_changes["data"] = folder_changes("data", ".json")
+    # Files which might have changed are collected from every folder first,
+    # then hashed together on a pool of threads.
+    pending = []
+    for (folder, entries) in listing.items():
+        all_changes[folder] = folder_changes(folder, entries)
+    with ThreadPoolExecutor() as executor:
+        hashes = executor.map(hash_file, [p[2] for p in pending],
+                              [p[4][1] for p in pending])
+        for ((changes, file_name, _, file_past, curr_stat), curr_hash) \
+                in zip(pending, hashes):
+            file_changes = _compare(file_past, curr_stat, curr_hash)
+            if file_changes:
+                changes[file_name] = file_changes
     print(all_changes)
 
     return all_changes
@@ -238,18 +755,17 @@ def process_folder_changes(changes: FolderChanges,
                            del_handler: Callable[[str], None],
                            history: Optional[Dict[str, FolderInfo]] = None) \
                            -> None:
-    for changed_file in changes[0].items():
-        (name, metadata) = changed_file
-        if history:
-            history[name] = metadata
+    if history is not None:
+        history.update(changes[0])
+        for deleted_file in changes[1]:
+            del history[deleted_file]
+    for name in changes[0]:
         mod_handler(name)
     for deleted_file in changes[1]:
-        if history:
-            history.pop(deleted_file)
         del_handler(deleted_file)
 
 
-def diff() -> None:
+def diff(verify: bool = False) -> None:
     """
     Displays what has changed since last generation of site.
     """
@@ -259,13 +775,10 @@ def diff() -> None:
     def del_handler(name: str) -> None:
         deletions.append(f"{folder}\\{name}")
 
-    with open(os.path.join(BASE_DIR, 'history.json')) as f:
-        history = json.load(f)
-
-    with open(os.path.join(BASE_DIR, 'meta.json')) as f:
-        meta = json.load(f)
+    history = load_history()
+    meta = load_json(META_PATH)
 
-    changes = get_changes(history, meta)
+    changes = get_changes(history, meta, verify=verify)
     modifications = []
     deletions = []
 
@@ -285,51 +798,150 @@ def diff() -> None:
         print(COLORS['red'] + '\n\t' + '\n\t'.join(deletions) + COLORS['endc'])
 
 
-@recursively_act_on_dir("posts/**/*.md")
-def get_all_front_matter(file: os.DirEntry[str], relpath: str) -> Dict[str, Dict]:
-    if not file.name.endswith(".md"):
-        return
-    with open(file.path) as f:
-        post = f.read()
+@recursively_act_on_dir(FOLDERS["posts"], ".md")
+def get_all_front_matter(file: os.DirEntry) -> Tuple[str, Dict]:
+    return (os.path.relpath(file.path, FOLDERS["posts"]),
+            read_front_matter(file.path))
+
+
+def read_front_matter(path: str) -> Dict:
+    """
+    Returns only the YAML front matter of the post at path. Front matter sits
+    at the top of the file, so usually only the first few KiB are read and
+    the markdown is never parsed.
+    """
+
+    with open(path) as f:
+        head = f.read(FRONT_MATTER_PEEK)
+        if head.startswith("---\n"):
+            lines = head.split("\n")
+            # The last line may have been cut short, unless the whole file
+            # fit in head.
+            complete = len(lines) if len(head) < FRONT_MATTER_PEEK \
+                else len(lines) - 1
+            for i in range(1, complete):
+                if FRONT_MATTER_FENCE_RE.fullmatch(lines[i]):
+                    # Any other closing fence markdown-it accepts is left to
+                    # the full parse below.
+                    if lines[i] == "---":
+                        return load_yaml("\n".join(lines[1:i])) or {}
+                    break
+        post = head + f.read()
+
     tokens = md.parse(post)
-    return (os.path.join(relpath, file.name), get_front_matter(tokens))
+    if tokens and tokens[0].type == "front_matter":
+        return load_yaml(tokens[0].content) or {}
+    return {}
+
+
+def load_yaml(text: str) -> Dict:
+    """
+    Loads a YAML mapping. Front matter is nearly always a flat list of
+    "key: text" lines, which parse_flat_yaml() handles without going through
+    the YAML machinery; anything else is left to the real parser.
+    """
+
+    mapping = parse_flat_yaml(text)
+    if mapping is None:
+        mapping = yaml.load(text, Loader=YamlLoader)
+    return mapping
+
+
+def parse_flat_yaml(text: str) -> Optional[Dict[str, str]]:
+    """
+    Parses text if every line is a "key: value" pair whose key and value YAML
+    would both read as plain strings, and returns None otherwise. Whether a
+    scalar is a plain string is decided by PyYAML's own implicit resolvers,
+    so dates, numbers, booleans and nulls always fall through to YAML.
+    """
+
+    resolvers = yaml.resolver.Resolver.yaml_implicit_resolvers
+
+    def is_str(scalar: str) -> bool:
+        return not any(regexp.match(scalar)
+                       for (_, regexp) in resolvers.get(scalar[0], ()))
+
+    mapping = {}
+    for line in text.splitlines():
+        if not line or line.isspace() or line.startswith('#'):
+            continue
+        match = FLAT_YAML_LINE_RE.fullmatch(line)
+        if match is None:
+            return None
+        (key, value) = match.groups()
+        if not is_str(key):
+            return None
+
+        if value[0] in "'\"":
+            inner = value[1:-1]
+            if len(value) < 2 or value[-1] != value[0] \
+                    or value[0] in inner or '\\' in inner:
+                return None
+            value = inner
+        elif value[0] in YAML_INDICATORS or FLAT_YAML_UNSAFE_RE.search(value) \
+                or not is_str(value):
+            return None
+        mapping[key] = value
+    return mapping
 
 
 def get_front_matter(tokens: List[Token]) -> Dict:
     front_matter = {}
     if tokens[0].type == "front_matter":
-        front_matter = yaml.safe_load(tokens[0].content)
+        front_matter = load_yaml(tokens[0].content)
     return {**front_matter, **word_count(tokens)}
 
 
 def word_count(tokens: List[Token]) -> Dict[str, int]:
-    def count(text: str) -> int:
-        return sum([el.strip(string.punctuation).isalpha() for el in text.split()])
+    texts = []
+    for token in tokens:
+        if token.type == "inline":
+            texts.extend(child.content for child in token.children or ()
+                         if child.type == "text")
+        elif token.type == "text":
+            texts.append(token.content)
 
-    info: Dict = {}
+    words = len(WORD_RE.findall(" ".join(texts)))
+    # Reading time at 200 words a minute, rounded in integer arithmetic.
+    return {"words": words, "minutes": (words + 100) // 200}
 
-    words: int = 0
-    for token in tokens:
-        if token.type == "text":
-            words += count(token.content)
-        elif token.type == "inline":
-            for child in token.children or ():
-                if child.type == "text":
-                    words += count(child.content)
 
-    info["words"] = words
-    info["minutes"] = int(round(info["words"] / 200))
-    return info
+def parse_post(post: str) -> Tuple[Dict, str]:
+    """
+    Returns the front matter and rendered HTML of a markdown post, rendering
+    from the same tokens the front matter was read from.
+    """
+
+    md_env = {}
+    tokens = md.parse(post, md_env)
+    front_matter = get_front_matter(tokens)
+    return (front_matter, md.renderer.render(tokens, md.options, md_env))
 
 
-def generate(incremental: bool=True) -> None:
+def render_post(name: str) -> str:
+    """
+    Renders the post at posts/name with the template set in its front matter.
+    Kept at module level so that it can be sent to worker processes.
+    """
+
+    with open(FOLDERS["posts"] + os.sep + name) as f:
+        post = f.read()
+    front_matter, rendered_md = parse_post(post)
+    template = get_template(front_matter["template"])
+    return template.render(post=front_matter, rendered_md=rendered_md)
+
+
+def generate(incremental: bool=True, verify: bool = False) -> None:
     """
     Genereate files for the site.
     """
 
     def make_dirs_for_file(dest_pathname: str) -> str:
-        dest = os.path.join(FOLDERS["site"], dest_pathname)
-        os.makedirs(os.path.split(dest)[0], exist_ok=True)
+        dest = site_prefix + dest_pathname
+        dest_dir = dest.rpartition(os.sep)[0]
+        if dest_dir not in made_dirs:
+            os.makedirs(dest_dir, exist_ok=True)
+            made_dirs.add(dest_dir)
         return dest
 
     def assets_mod_handler(name: str) -> None:
@@ -337,37 +949,33 @@ def generate(incremental: bool=True) -> None:
             return
 
         print(f"Copying '{name}' from 'assets\\' to 'site\\'")
-        src = os.path.join(FOLDERS["assets"], name)
+        changed_assets.append(name)
+
+    def copy_asset(name: str) -> None:
+        src = assets_prefix + name
         dest = make_dirs_for_file(name)
-        copy(src, dest)
+        copy_file(src, dest)
 
     def posts_mod_handler(name: str) -> None:
         if name in meta["no_output"]["templates"]:
             return
 
         print(f"Generating post 'posts\\{name}'...")
+        changed_posts.append(name)
 
-        src = os.path.join(FOLDERS["posts"], name)
-        dest_pathname = os.path.join("posts", os.path.splitext(name)[0] + ".html")
-
-        with open(src) as f:
-            post = f.read()
-        tokens = md.parse(post)
-        front_matter = get_front_matter(tokens)
-        rendered_md = md.render(post)
-        template = env.get_template(front_matter["template"].replace('\\', '/'))
-        output = template.render(post=front_matter, rendered_md = rendered_md)
-
-        dest = make_dirs_for_file(dest_pathname)
-        with open(dest, 'w') as f:
-            f.write(output)
+    def write_posts(outputs: Iterable[str]) -> None:
+        for (name, output) in zip(changed_posts, outputs):
+            dest_pathname = posts_prefix + name[:-len(ROUTES["posts"])] + ".html"
+            dest = make_dirs_for_file(dest_pathname)
+            with open(dest, 'w') as f:
+                f.write(output)
 
     def templates_mod_handler(name: str) -> None:
         if name in meta["no_output"]["templates"]:
             return
 
         print(f"Rendering 'site\\{name}'...")
-        template = env.get_template(name.replace("\\", "/"))
+        template = get_template(name)
         output = template.render()
 
         dest = make_dirs_for_file(name)
@@ -395,37 +1003,74 @@ def generate(incremental: bool=True) -> None:
     def data_handler(name: str) -> None:
         print(f"Updating metadata for 'data\\{name}'...")
 
-    with open(os.path.join(BASE_DIR, 'history.json')) as f:
-        history = json.load(f)
-
-    with open(os.path.join(BASE_DIR, 'meta.json')) as f:
-        meta = json.load(f)
+    def fill_digest(path: str, record: FileInfo) -> None:
+        # Hashed only now that the outputs are written. A file changed since
+        # it was detected keeps an empty digest and is rebuilt next time.
+        try:
+            digest = hash_file(path, record[1])
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        if [st.st_mtime_ns, st.st_size, st.st_ino] == record[:3]:
+            record[3] = digest
+
+    history = load_history()
+    meta = load_json(META_PATH)
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    site_prefix = FOLDERS["site"] + os.sep
+    assets_prefix = FOLDERS["assets"] + os.sep
+    posts_prefix = "posts" + os.sep
+    # Directories already made this run, so that files sharing a directory
+    # do not each call makedirs.
+    made_dirs = set()
 
     print("Detecting changed files...")
 
     no_changes = incremental
-    changes = get_changes(history, meta, not incremental)
+    past_stamps = dict(history.get("stamps", {}))
+    changes = get_changes(history, meta, not incremental, verify)
 
     if no_changes:
-        for folder in ["assets", "data", "templates", "posts"]:
+        for folder in ROUTES:
             if len(changes[folder][0]) + len(changes[folder][1]) > 0:
                 no_changes = False
                 break
     if no_changes:
+        # Files whose contents did not change may still have had their
+        # stamps refreshed, or, when verifying, their digests filled in.
+        if verify or history["stamps"] != past_stamps:
+            save_history(history)
         print("No changes!")
         return
 
-    send_history = lambda x: history[x] if incremental else None
+    changed_assets = []
+    changed_posts = []
     process_folder_changes(changes["templates"], templates_mod_handler, del_handler,
-                           send_history("templates"))
+                           history["templates"])
     process_folder_changes(changes["assets"], assets_mod_handler, del_handler,
-                           send_history("assets"))
+                           history["assets"])
+    with ThreadPoolExecutor() as executor:
+        # list() so that an exception raised by a copy is not swallowed
+        list(executor.map(copy_asset, changed_assets))
+
     process_folder_changes(changes["posts"], posts_mod_handler, posts_del_handler,
-                           send_history("posts"))
+                           history["posts"])
+    if len(changed_posts) < PARALLEL_POSTS_THRESHOLD:
+        write_posts(map(render_post, changed_posts))
+    else:
+        chunksize = max(1, len(changed_posts) // (4 * (os.cpu_count() or 1)))
+        with ProcessPoolExecutor() as executor:
+            write_posts(executor.map(render_post, changed_posts,
+                                     chunksize=chunksize))
     process_folder_changes(changes["data"], data_handler, data_handler,
-                           send_history("data"))
-    with open('history.json', 'w') as f:
-        json.dump(history, f, indent=4)
+                           history["data"])
+
+    unhashed = [(folder + os.sep + name, record)
+                for folder in ROUTES
+                for (name, record) in history[folder].items() if not record[3]]
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(lambda item: fill_digest(*item), unhashed))
+    save_history(history)
 
     print("Done!")
 
@@ -439,106 +1084,270 @@ def run() -> None:
     SERVER_PORT = 8080
     SCRIPT_LOCATION = os.path.dirname(os.path.realpath(__file__))
 
-    with open(os.path.join(BASE_DIR, 'meta.json')) as f:
-        meta = json.load(f)
+    meta = load_json(META_PATH)
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    templates_prefix = FOLDERS["templates"] + os.sep
+    assets_prefix = FOLDERS["assets"] + os.sep
+    posts_prefix = FOLDERS["posts"] + os.sep
+    base_prefix = BASE_DIR + os.sep
 
     with open(os.path.join(SCRIPT_LOCATION, "injection.html")) as inj:
         injection = inj.read()
 
-    index_exists = os.path.isfile(os.path.join(FOLDERS["templates"], "index.html"))
-    not_found_exists = os.path.isfile(os.path.join(FOLDERS["templates"], "404.html"))
+    def build_routes() -> Dict[str, Tuple[str, str]]:
+        """
+        Maps every servable URL path to the kind of file behind it and where
+        that file is. Assets take precedence over posts, and posts over
+        templates.
+        """
+
+        routes = {}
+        prefix_len = len(FOLDERS["templates"]) + 1
+        for entry in walk(FOLDERS["templates"], ".html"):
+            name = entry.path[prefix_len:].replace('\\', '/')
+            routes[name] = routes[name[:-len(".html")]] = ("template", name)
+
+        prefix_len = len(FOLDERS["posts"]) + 1
+        for entry in walk(FOLDERS["posts"], ".md"):
+            url = "posts/" + entry.path[prefix_len:-len(".md")].replace('\\', '/')
+            routes[url] = routes[url + ".html"] = ("post", entry.path)
+
+        prefix_len = len(FOLDERS["assets"]) + 1
+        for entry in walk(FOLDERS["assets"]):
+            routes[entry.path[prefix_len:].replace('\\', '/')] = ("asset", entry.path)
+        return routes
+
+    def urls_for(path: str) -> List[str]:
+        """
+        Returns the URL paths that the file at path could be served under,
+        as build_routes() would map them.
+        """
+
+        for (prefix, ext) in ((templates_prefix, ".html"), (posts_prefix, ".md"),
+                              (assets_prefix, "")):
+            if path.startswith(prefix) and path.endswith(ext):
+                name = path[len(prefix):]
+                break
+        else:
+            return []
+        if any(part.startswith('.') for part in name.split(os.sep)):
+            return []
+
+        name = name.replace('\\', '/')
+        if prefix == templates_prefix:
+            return [name, name[:-len(".html")]]
+        if prefix == posts_prefix:
+            url = "posts/" + name[:-len(".md")]
+            return [url, url + ".html"]
+        return [name]
+
+    def resolve(url: str) -> Optional[Tuple[str, str]]:
+        """
+        Finds the file a URL path is served from, with the same precedence as
+        build_routes(), by checking the few places it could be.
+        """
+
+        path = assets_prefix + url.replace('/', os.sep)
+        if os.path.isfile(path):
+            return ("asset", path)
+        if url.startswith("posts/"):
+            stem = url[len("posts/"):]
+            if stem.endswith(".html"):
+                stem = stem[:-len(".html")]
+            path = posts_prefix + stem.replace('/', os.sep) + ".md"
+            if os.path.isfile(path):
+                return ("post", path)
+        name = url if url.endswith(".html") else url + ".html"
+        if os.path.isfile(templates_prefix + name.replace('/', os.sep)):
+            return ("template", name)
+        return None
+
+    # Keyed on the mtime as well, so an edited post is parsed again.
+    @lru_cache(maxsize=256)
+    def parse_post_file(path: str, mtime_ns: int) -> Tuple[Dict, str]:
+        with open(path) as f:
+            return parse_post(f.read())
 
     class DevServer(BaseHTTPRequestHandler):
-        def write_template(self, template: Template) -> None:
-            self.wfile.write(bytes(template.render() + injection, "utf-8"))
+        def write_template(self, template: Template, **context) -> None:
+            # The context is passed to render() rather than set on the
+            # template's globals, which are shared by every request.
+            self.wfile.write(bytes(template.render(**context) + injection,
+                                   "utf-8"))
 
         def send_404(self) -> None:
             self.send_response(404)
             self.end_headers()
 
-            if not_found_exists:
-                template = env.get_template("404.html")
-                template.globals.update()
-                self.write_template(template)
+            if event_handler.routes.get("404.html") == ("template", "404.html"):
+                self.write_template(env.get_template("404.html"))
 
             else:
                 self.wfile.write(bytes("<h1>404</h1>", "utf-8"))
 
+        def send_asset(self, path: str) -> None:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                self.send_404()
+                return
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                # sendfile() copies from the page cache to the socket inside
+                # the kernel, falling back to a send() loop where missing.
+                # Browsers routinely drop media requests part way through.
+                try:
+                    self.connection.sendfile(f)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
         def do_GET(self) -> None:
             requested = self.path[1:]
-            requested_no_ext, ext = os.path.splitext(requested)
+            route = event_handler.routes.get(requested)
+
+            if requested == "events":
+                self.send_events()
 
-            if index_exists and requested == "":
+            elif requested == "" and \
+                    event_handler.routes.get("index") == ("template", "index.html"):
                 self.send_response(301)
                 self.send_header('Location','/index')
                 self.end_headers()
 
-            elif os.path.isfile(os.path.join(FOLDERS["assets"], requested)):
+            elif route is None:
+                self.send_404()
+
+            elif route[0] == "asset":
+                self.send_asset(route[1])
+
+            elif route[0] == "post":
+                try:
+                    mtime_ns = os.stat(route[1]).st_mtime_ns
+                except FileNotFoundError:
+                    self.send_404()
+                    return
+                front_matter, rendered_md = parse_post_file(route[1], mtime_ns)
                 self.send_response(200)
                 self.end_headers()
-                self.wfile.write(open(os.path.join(FOLDERS["assets"], requested),'rb').read())
-
-            elif ext in ['', '.html'] and requested_no_ext != '':
-                if os.path.isfile(requested_no_ext + ".md"):
-                    requested = requested_no_ext + ".md"
-                    self.send_response(200)
-                    self.end_headers()
-                    with open(requested) as f:
-                        post = f.read()
-                    tokens = md.parse(post)
-                    front_matter = get_front_matter(tokens)
-                    rendered_md = md.render(post)
-                    template = env.get_template(meta["base"]["posts"].replace('\\', '/'))
-                    template.globals.update(post=front_matter, rendered_md=rendered_md)
-                    self.write_template(template)
-
-                elif os.path.isfile(os.path.join(FOLDERS["templates"], requested_no_ext + ".html")):
-                    requested = requested_no_ext + ".html"
-                    self.send_response(200)
-                    self.end_headers()
-                    template = env.get_template((requested).replace('\\', '/'))
-                    self.write_template(template)
-
-                else:
-                    self.send_404()
+                template = env.get_template(
+                    meta["base"]["posts"].replace('\\', '/'))
+                self.write_template(template, post=front_matter,
+                                    rendered_md=rendered_md)
 
             else:
-                self.send_404()
-
-        def do_POST(self):
-            if self.path == "/refresh":
                 self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps({ 'refresh': event_handler.modified }).encode(encoding='utf_8'))
-                if event_handler.modified:
-                    event_handler.modified = ""
+                template = env.get_template(route[1])
+                self.write_template(template)
+
+        def send_events(self) -> None:
+            """
+            Streams the path of every modified file to the browser as
+            server-sent events, for as long as the page stays open.
+            """
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+
+            client = queue.SimpleQueue()
+            with event_handler.lock:
+                event_handler.clients.append(client)
+            try:
+                while True:
+                    try:
+                        modified = client.get(timeout=EVENTS_KEEPALIVE)
+                        self.wfile.write(f"data: {modified}\n\n".encode())
+                    except queue.Empty:
+                        self.wfile.write(b": keep-alive\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with event_handler.lock:
+                    event_handler.clients.remove(client)
 
     class DevServerEventHandler(FileSystemEventHandler):
         def __init__(self) -> None:
             super().__init__()
-            self.modified = ""
+            self.routes = build_routes()
+            # One queue per open event stream.
+            self.clients: List[queue.SimpleQueue] = []
+            # A save can fire several modified events for the same file.
+            # Each one restarts a short timer, and only the last one is
+            # passed on to the browser.
+            self.pending: Dict[str, threading.Timer] = {}
+            self.lock = threading.Lock()
+
+        def update_routes(self, event: FileSystemEvent, *paths: str) -> None:
+            # A directory brings along or takes away everything inside it,
+            # which only a full walk can find. A file only affects its own
+            # few URLs, each of which may now be served from another file.
+            if event.is_directory:
+                self.routes = build_routes()
+                return
+            for path in paths:
+                for url in urls_for(path):
+                    route = resolve(url)
+                    if route is None:
+                        self.routes.pop(url, None)
+                    else:
+                        self.routes[url] = route
+
+        def on_created(self, event: FileSystemEvent) -> None:
+            self.update_routes(event, event.src_path)
+
+        def on_deleted(self, event: FileSystemEvent) -> None:
+            self.update_routes(event, event.src_path)
+
+        def on_moved(self, event: FileSystemEvent) -> None:
+            self.update_routes(event, event.src_path, event.dest_path)
 
         def on_modified(self, event: DirModifiedEvent | FileModifiedEvent) -> None:
-            if FOLDERS["templates"] in event.src_path:
-                start_path = FOLDERS["templates"]
-            elif FOLDERS["assets"] in event.src_path:
-                start_path = FOLDERS["assets"]
-            else:
-                start_path = BASE_DIR
+            # A directory's mtime changes along with the file that changed
+            # inside it; only the file itself is worth reloading for.
+            if event.is_directory:
+                return
 
-            self.modified = os.path.relpath(event.src_path, start_path).replace('\\', '/')
-            modified_no_ext, ext = os.path.splitext(self.modified)
+            with self.lock:
+                timer = self.pending.pop(event.src_path, None)
+                if timer is not None:
+                    timer.cancel()
+                timer = threading.Timer(MODIFIED_DEBOUNCE, self.commit_modified,
+                                        (event.src_path,))
+                self.pending[event.src_path] = timer
+                timer.start()
+
+        def commit_modified(self, src_path: str) -> None:
+            with self.lock:
+                self.pending.pop(src_path, None)
+            # Every watched folder is inside BASE_DIR, so one prefix matches.
+            for prefix in (templates_prefix, assets_prefix, base_prefix):
+                if src_path.startswith(prefix):
+                    modified = src_path[len(prefix):].replace('\\', '/')
+                    break
+            modified_no_ext, ext = os.path.splitext(modified)
             if ext in [".html", ".md"]:
-                self.modified = modified_no_ext
+                modified = modified_no_ext
+            with self.lock:
+                for client in self.clients:
+                    client.put(modified)
 
-    print(get_all_front_matter(FOLDERS["posts"]))
+    print(get_all_front_matter())
     event_handler = DevServerEventHandler()
+    # Observer is already the platform's native backend (inotify, FSEvents,
+    # ReadDirectoryChangesW). Only the source folders are watched, so that
+    # writes to site/ by a concurrent generate do not trigger reloads.
     observer = Observer()
-    observer.schedule(event_handler, BASE_DIR, recursive=True)
+    for folder in ["templates", "posts", "assets", "data"]:
+        if os.path.isdir(FOLDERS[folder]):
+            observer.schedule(event_handler, FOLDERS[folder], recursive=True)
     observer.start()
 
-    server = HTTPServer((HOST_NAME, SERVER_PORT), DevServer)
+    server = ThreadingHTTPServer((HOST_NAME, SERVER_PORT), DevServer)
     print("Server started http://%s:%s" % (HOST_NAME, SERVER_PORT))
 
     try:
@@ -550,20 +1359,21 @@ def run() -> None:
 
 
 def main() -> None:
-    cmd = get_args()
+    args = get_args()
+    cmd = args.command
 
     print()
     if cmd == "create":
        create()
 
     elif cmd == "generate":
-        generate()
+        generate(verify=args.verify)
 
     elif cmd == "run":
         run()
 
     elif cmd == "diff":
-        diff()
+        diff(verify=args.verify)
 
 
 if __name__ == "__main__":